@@ -1,4 +1,16 @@
 from maker import *
+import contextlib
+import io
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+
+_BOOST_LDADD = ("$(BOOST_SYSTEM_LIB)", "$(BOOST_FILESYSTEM_LIB)",
+                "$(BOOST_PROGRAM_OPTIONS_LIB)", "$(BOOST_REGEX_LIB)",
+                "$(BOOST_CHRONO_LIB)")
+
+#Deletes the line continuations and indentation from a Makefile line
+_STRIP_MAKEFILE_SPACING = str.maketrans('', '', '\\ ')
+
 
 def all_boost_LDADD_flags():
     """Returns list of all the autotools boost library linker flags
@@ -14,15 +26,7 @@ def all_boost_LDADD_flags():
     list of str
 
     """
-
-    def flagify(lib):
-        return "$(BOOST_{}_LIB)".format(lib)
-
-    return [
-        flagify(lib)
-        for lib in
-        ["SYSTEM", "FILESYSTEM", "PROGRAM_OPTIONS", "REGEX", "CHRONO"]
-    ]
+    return list(_BOOST_LDADD)
 
 
 def make_libgtest():
@@ -43,7 +47,7 @@ def make_libgtest():
         ])
 
 
-def make_unit_test(unit_test_directory):
+def make_unit_test(unit_test_directory, last_directory=None):
     """Creates the Makefile segment for a particular unit test. Will
     include all the c++ files in the directory as SOURCES, and all
     the other files as EXTRA_DIST. Only files being tracked by git
@@ -56,21 +60,24 @@ def make_unit_test(unit_test_directory):
     Parameters
     ----------
     unit_test_directory : path to unit test, e.g. "tests/unit/App/"
+    last_directory : name of the unit test directory, e.g. "App". Worked
+        out from unit_test_directory if not given.
 
     Returns
     -------
     str
 
     """
-    last_directory = os.path.basename(os.path.normpath(unit_test_directory))
+    if last_directory is None:
+        last_directory = os.path.basename(
+            os.path.normpath(unit_test_directory))
     test_name = "casm_unit_{}".format(last_directory)
 
     all_dir_files_relative = [
-        os.path.join(unit_test_directory, f)
-        for f in os.listdir(unit_test_directory)
+        entry.path for entry in os.scandir(unit_test_directory)
     ]
-    only_tracked_files = purge_untracked_files(all_dir_files_relative)
-    only_makeable_files = purge_git_related_files(only_tracked_files)
+    only_makeable_files = purge_untracked_and_git_related_files(
+        all_dir_files_relative)
 
     #TODO:
     #I think it would be better if instead of mixing up EXTRA_DIST files
@@ -89,7 +96,8 @@ def make_unit_test(unit_test_directory):
         LDADD=ldadd,
         CPPFLAGS=["$(AM_CPPFLAGS)", "-I$(top_srcdir)/tests/unit/"])
 
-    extra_files = [f for f in only_makeable_files if f not in source_files]
+    source_set = set(source_files)
+    extra_files = [f for f in only_makeable_files if f not in source_set]
     value += "\n"
     value += make_add_to_EXTRA_DIST(extra_files)
 
@@ -134,30 +142,34 @@ def make_aggregated_unit_test():
     string
 
     """
-    value = horizontal_divide()
+    parts = [horizontal_divide()]
 
     print("Create Makefile segment for libgtest")
-    value += make_libgtest()
-    value += horizontal_divide()
+    parts += [make_libgtest(), horizontal_divide()]
 
     print("Create Makefile segment for libcasmtesting")
-    value += make_libcasmtesting()
-    value += horizontal_divide()
+    parts += [make_libcasmtesting(), horizontal_divide()]
 
     test_root = "tests/unit"
-    test_directories = [
-        name
-        for name in
-        [os.path.join(test_root, ls) for ls in os.listdir(test_root)]
-        if os.path.isdir(name) and "test_projects" not in name
+    test_entries = [
+        entry for entry in os.scandir(test_root)
+        if entry.is_dir() and "test_projects" not in entry.name
     ]
+    test_directories = [entry.path for entry in test_entries]
+    test_names = [entry.name for entry in test_entries]
 
-    for d in test_directories:
-        print("Create Makefile segment for unit test {}".format(d))
-        value += make_unit_test(d)
-        value += horizontal_divide()
+    #Load the tracked files before the threads start so they don't all
+    #ask git for them at once
+    all_absolute_paths_tracked_by_git()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        unit_tests = list(
+            executor.map(make_unit_test, test_directories, test_names))
 
-    return value
+    for d, unit_test in zip(test_directories, unit_tests):
+        print("Adding Makefile segment for unit test {}".format(d))
+        parts += [unit_test, horizontal_divide()]
+
+    return "".join(parts)
 
 
 def is_extensionless_Eigen_header(filepath):
@@ -178,33 +190,24 @@ def is_extensionless_Eigen_header(filepath):
     return parent == "include/casm/external/Eigen"
 
 
-def make_include(includeable_path):
+def make_include(includeable_path, header_files):
     """Create a Makefile segment for including the files of the
     given path as headers
 
     Parameters
     ----------
     includeable_path : str, path is assumed to begin with "include/"
+    header_files : list of header files tracked by git within includeable_path
 
     Returns
     -------
     str
 
     """
-    assert (includeable_path[0:8] == "include/")
-
-    available_files = [
-        os.path.join(includeable_path, f) for f in os.listdir(includeable_path)
-        if os.path.isfile(os.path.join(includeable_path, f))
-    ]
-    only_tracked_files = purge_untracked_files(available_files)
-    only_header_files = [
-        f for f in only_tracked_files
-        if is_extensionless_Eigen_header(f) or has_header_extension(f)
-    ]
+    assert includeable_path.startswith("include/")
 
     target_path = includeable_path[8::]
-    return make_HEADERS(target_path, only_header_files)
+    return make_HEADERS(target_path, header_files)
 
 
 def make_recursive_include(search_root):
@@ -216,24 +219,28 @@ def make_recursive_include(search_root):
     str
 
     """
-    value = horizontal_divide()
+    parts = [horizontal_divide()]
 
-    dirpaths = [dirpath for dirpath, dirnames, files in os.walk(search_root)]
+    files_by_directory = {}
+    for f in tracked_files_under(search_root):
+        files_by_directory.setdefault(os.path.dirname(f), []).append(f)
 
-    for d in dirpaths:
-        print("Create Makefile segment for headers in {}".format(d))
-        candidate = make_include(d)
+    for d in sorted(files_by_directory):
+        only_header_files = [
+            f for f in files_by_directory[d]
+            if is_extensionless_Eigen_header(f) or has_header_extension(f)
+        ]
 
-        #If this is true, then you passed a directory with no headers, and there's just
-        #a dangling HEADER list
-        if search_root not in candidate:
+        #Don't bother making a dangling HEADER list for a directory
+        #that has no headers
+        if not only_header_files:
             print("Skipping {} because there are no headers there...".format(d))
             continue
 
-        value += candidate
-        value += horizontal_divide()
+        print("Create Makefile segment for headers in {}".format(d))
+        parts += [make_include(d, only_header_files), horizontal_divide()]
 
-    return value
+    return "".join(parts)
 
 
 def make_ccasm():
@@ -263,34 +270,33 @@ def make_casm_complete():
     """
     print("Create Makefile for casm-complete program")
 
-    value = "if ENABLE_BASH_COMPLETION\n"
-    value += "bashcompletiondir=$(BASH_COMPLETION_DIR)\n\n"
-
-    value += basic_maker_string("dist_bashcompletion_DATA", "=",
-                                ["apps/completer/casm"])
-    value += "\n"
-
-    value += make_add_to_PROGRAMS(
-        "casm-complete",
-        "bin",
-        SOURCES=["apps/completer/complete.cpp"],
-        LDADD=["libcasm.la"] + all_boost_LDADD_flags())
-
-    value += "\n\nendif"
+    parts = [
+        "if ENABLE_BASH_COMPLETION\n",
+        "bashcompletiondir=$(BASH_COMPLETION_DIR)\n\n",
+        basic_maker_string("dist_bashcompletion_DATA", "=",
+                           ["apps/completer/casm"]),
+        "\n",
+        make_add_to_PROGRAMS(
+            "casm-complete",
+            "bin",
+            SOURCES=["apps/completer/complete.cpp"],
+            LDADD=["libcasm.la"] + all_boost_LDADD_flags()),
+        "\n\nendif",
+    ]
 
-    return value
+    return "".join(parts)
 
 
 def make_lib(libname, search_root, additional_sources, **kwargs):
-    """Descends into search_root and adds every file with
-    a source extension as a SOURCE. Given a list of the
+    """Adds every file below search_root that is tracked by git
+    and has a source extension as a SOURCE. Given a list of the
     related headers, it will also include those alongside the
     sources
 
     Parameters
     ----------
     libname : name of the library, e.g. libcasm
-    search_root : path from which to descend and search for source files
+    search_root : path, relative to the git root, to search for source files
     additional_sources : list of paths, these should be all the headers
 
     Returns
@@ -298,11 +304,8 @@ def make_lib(libname, search_root, additional_sources, **kwargs):
     str
 
     """
-    files = [(dirpath, files)
-             for dirpath, dirnames, files in os.walk(search_root)]
     source_files = [
-        os.path.join(d, f) for d, fs in files for f in fs
-        if has_source_extension(f)
+        f for f in tracked_files_under(search_root) if has_source_extension(f)
     ]
 
     return make_add_to_LTLIBRARIES(
@@ -355,7 +358,9 @@ def make_libccasm(additional_sources):
 
 
 def string_to_file(string, filepath):
-    """Writes the string to the provided file
+    """Writes the string to the provided file. If the file already
+    has exactly that content it is left untouched, so that its timestamp
+    doesn't trigger automake and make to rerun.
 
     Parameters
     ----------
@@ -367,13 +372,59 @@ def string_to_file(string, filepath):
     void
 
     """
-    makefile = open(filepath, 'w')
-    makefile.write(string)
-    makefile.close()
+    try:
+        with open(filepath, 'r') as makefile:
+            if makefile.read() == string:
+                return
+    except FileNotFoundError:
+        pass
+
+    with open(filepath, 'w') as makefile:
+        makefile.write(string)
 
     return
 
 
+def _make_with_log(make_chunk, *args):
+    """Runs make_chunk(*args) in a worker process of main(), holding
+    back everything it prints so that main() can print it in order.
+
+    Parameters
+    ----------
+    make_chunk : function that returns a Makefile segment
+    *args : arguments for make_chunk
+
+    Returns
+    -------
+    (str, str), the Makefile segment and what was printed making it
+
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        chunk = make_chunk(*args)
+    return chunk, log.getvalue()
+
+
+def _seed_tracked_files(tracked_files, tracked_paths):
+    """Initializer for the worker processes of main(). Fills the
+    caches of all_files_tracked_by_git() and
+    all_absolute_paths_tracked_by_git() with values that were already
+    computed, so no worker has to call git for them.
+
+    Parameters
+    ----------
+    tracked_files : frozenset of str, relative to the git root
+    tracked_paths : frozenset of str, absolute
+
+    Returns
+    -------
+    void
+
+    """
+    all_files_tracked_by_git.cached_files = tracked_files
+    all_absolute_paths_tracked_by_git.cached_paths = tracked_paths
+
+
 def _exit_on_bad_run_directory():
     print(
         "This script must be run from the root directory of the CASMcode-dev repo."
@@ -392,47 +443,57 @@ def main():
     except git.exc.InvalidGitRepositoryError:
         _exit_on_bad_run_directory()
 
-    chunk = make_ccasm()
-    target = os.path.join("apps", "ccasm", "Makemodule.am")
-    string_to_file(chunk, target)
-
-
-    chunk = make_casm_complete()
-    target = os.path.join("apps", "completer", "Makemodule.am")
-    string_to_file(chunk, target)
-
-
-    chunk = make_aggregated_unit_test()
-    target = os.path.join("tests", "unit", "Makemodule.am")
-    string_to_file(chunk, target)
-
-
-    chunk = make_recursive_include("include/casm")
-    target = os.path.join("include", "casm", "Makemodule.am")
-    string_to_file(chunk, target)
-
-    header_files = [
-        f.replace('\\', '').replace(' ', '') for f in chunk.splitlines()
-        if "include/" in f
-    ]
-
-    chunk = make_libcasm(header_files)
-    target = os.path.join("src", "casm", "Makemodule.am")
-    string_to_file(chunk, target)
-
-
-    chunk = make_recursive_include("include/ccasm")
-    target = os.path.join("include", "ccasm", "Makemodule.am")
-    string_to_file(chunk, target)
-
-    header_files = [
-        f.replace('\\', '').replace(' ', '') for f in chunk.splitlines()
-        if "include/" in f
-    ]
-
-    chunk = make_libccasm(header_files)
-    target = os.path.join("src", "ccasm", "Makemodule.am")
-    string_to_file(chunk, target)
+    #Every worker gets the tracked files up front, instead of each one
+    #asking git for them again
+    seed = (all_files_tracked_by_git(), all_absolute_paths_tracked_by_git())
+
+    ccasm_target = os.path.join("apps", "ccasm", "Makemodule.am")
+    casm_complete_target = os.path.join("apps", "completer", "Makemodule.am")
+    unit_test_target = os.path.join("tests", "unit", "Makemodule.am")
+    casm_include_target = os.path.join("include", "casm", "Makemodule.am")
+    libcasm_target = os.path.join("src", "casm", "Makemodule.am")
+    ccasm_include_target = os.path.join("include", "ccasm", "Makemodule.am")
+    libccasm_target = os.path.join("src", "ccasm", "Makemodule.am")
+
+    pending = {}
+    with ProcessPoolExecutor(
+            initializer=_seed_tracked_files, initargs=seed) as executor:
+        pending[ccasm_target] = executor.submit(_make_with_log, make_ccasm)
+        pending[casm_complete_target] = executor.submit(
+            _make_with_log, make_casm_complete)
+        pending[unit_test_target] = executor.submit(_make_with_log,
+                                                    make_aggregated_unit_test)
+        pending[casm_include_target] = executor.submit(
+            _make_with_log, make_recursive_include, "include/casm")
+        pending[ccasm_include_target] = executor.submit(
+            _make_with_log, make_recursive_include, "include/ccasm")
+
+        #The libraries list their headers as sources, so each one has to
+        #wait for its own include segment to finish
+        libraries = {
+            pending[casm_include_target]: (make_libcasm, libcasm_target),
+            pending[ccasm_include_target]: (make_libccasm, libccasm_target),
+        }
+        for include in as_completed(libraries):
+            make_library, target = libraries[include]
+            chunk, log = include.result()
+            header_files = [
+                f.translate(_STRIP_MAKEFILE_SPACING)
+                for f in chunk.splitlines() if "include/" in f
+            ]
+            pending[target] = executor.submit(_make_with_log, make_library,
+                                              header_files)
+
+        #Print what each worker logged in a fixed order, rather than
+        #however the workers happened to interleave
+        for target in [
+                ccasm_target, casm_complete_target, unit_test_target,
+                casm_include_target, libcasm_target, ccasm_include_target,
+                libccasm_target
+        ]:
+            chunk, log = pending[target].result()
+            print(log, end="")
+            string_to_file(chunk, target)
 
 if __name__ == "__main__":
     main()
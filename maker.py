@@ -1,7 +1,6 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-import glob
 import os
 import subprocess
 import git
@@ -61,13 +60,7 @@ def basic_maker_string(variable, operator, targets):
 
     """
     value = "{} {} \\\n".format(variable, operator)
-    # spacing = len(value) - 2
-    for target in targets:
-        # value += spacing * " "
-        value += vertical_space()
-        value += target
-        if target != targets[-1]:
-            value += "\\\n"
+    value += "\\\n".join(vertical_space() + target for target in targets)
     return value
 
 
@@ -101,18 +94,21 @@ def make_add_to_LTLIBRARIES(libname, LT_prefix, **kwargs):
     str
 
     """
-    value = ""
-    value += basic_maker_string("{}_LTLIBRARIES".format(LT_prefix), '+=',
-                                ["{}.la".format(libname)])
+    parts = [
+        basic_maker_string("{}_LTLIBRARIES".format(LT_prefix), '+=',
+                           ["{}.la".format(libname)])
+    ]
 
     for k in kwargs:
         if len(kwargs[k]) == 0:
             continue
-        value += "\n"
-        value += basic_maker_string("{}_la_{}".format(
-            libname.replace('-', '_'), k), '=', kwargs[k])
+        parts += [
+            "\n",
+            basic_maker_string("{}_la_{}".format(
+                libname.replace('-', '_'), k), '=', kwargs[k])
+        ]
 
-    return value
+    return "".join(parts)
 
 
 def make_add_to_PROGRAMS(program_name, PROGRAMS_prefix, **kwargs):
@@ -131,18 +127,21 @@ def make_add_to_PROGRAMS(program_name, PROGRAMS_prefix, **kwargs):
     str
 
     """
-    value = ""
-    value += basic_maker_string("{}_PROGRAMS".format(PROGRAMS_prefix), '+=',
-                                [program_name])
+    parts = [
+        basic_maker_string("{}_PROGRAMS".format(PROGRAMS_prefix), '+=',
+                           [program_name])
+    ]
 
     for k in kwargs:
         if len(kwargs[k]) == 0:
             continue
-        value += "\n"
-        value += basic_maker_string("{}_{}".format(
-            program_name.replace('-', '_'), k), '=', kwargs[k])
+        parts += [
+            "\n",
+            basic_maker_string("{}_{}".format(
+                program_name.replace('-', '_'), k), '=', kwargs[k])
+        ]
 
-    return value
+    return "".join(parts)
 
 
 def make_add_to_EXTRA_DIST(files):
@@ -211,16 +210,23 @@ def files_with_extension_at_directory(extensions, directory):
     list of str
 
     """
+    extensions = tuple(extensions)
+    #Hidden files are skipped, same as glob would
     files = [
-        f
-        for ext in extensions
-        for f in glob.glob(os.path.join(directory, "*{}".format(ext)))
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and not entry.name.startswith('.')
+        and entry.name.endswith(extensions)
     ]
     return files
 
 
 #------------------------------------------------------------------#
 
+_HEADER_EXTENSIONS = (".h", ".hh", ".hpp")
+_SOURCE_EXTENSIONS = (".c", ".cc", ".cxx", ".cpp")
+_HEADER_AND_SOURCE_EXTENSIONS = _HEADER_EXTENSIONS + _SOURCE_EXTENSIONS
+_GIT_RELATED_FILENAMES = frozenset([".gitignore"])
+
 
 def header_extensions():
     """List of extensions that are considered header files:
@@ -230,7 +236,7 @@ def header_extensions():
     list of str
 
     """
-    return [".h", ".hh", ".hpp"]
+    return list(_HEADER_EXTENSIONS)
 
 
 def source_extensions():
@@ -241,7 +247,7 @@ def source_extensions():
     list of str
 
     """
-    return [".c", ".cc", ".cxx", ".cpp"]
+    return list(_SOURCE_EXTENSIONS)
 
 
 def has_header_extension(filepath):
@@ -257,10 +263,7 @@ def has_header_extension(filepath):
     bool
 
     """
-    for ext in header_extensions():
-        if filepath.endswith(ext):
-            return True
-    return False
+    return filepath.endswith(_HEADER_EXTENSIONS)
 
 
 def has_source_extension(filepath):
@@ -276,59 +279,110 @@ def has_source_extension(filepath):
     bool
 
     """
-    for ext in source_extensions():
-        if filepath.endswith(ext):
-            return True
-    return False
+    return filepath.endswith(_SOURCE_EXTENSIONS)
 
 
 def header_and_source_extensions():
-    return header_extensions() + source_extensions()
+    """List of extensions that are considered either header or source
+    files, as defined by header_extensions() and source_extensions()
+    Returns
+    -------
+    list of str
+
+    """
+    return list(_HEADER_AND_SOURCE_EXTENSIONS)
 
 
+@static_vars(cached_roots={})
 def git_root(path):
-    git_repo = git.Repo(path, search_parent_directories=True)
-    git_root = git_repo.git.rev_parse("--show-toplevel")
-    return git_root
+    """Top level directory of the git repository that contains
+    the given path. The result is cached for each path, so git
+    is only asked once per directory.
+
+    Parameters
+    ----------
+    path : path within a git repository
+
+    Returns
+    -------
+    str
+
+    """
+    if path not in git_root.cached_roots:
+        git_repo = git.Repo(path, search_parent_directories=True)
+        git_root.cached_roots[path] = git_repo.git.rev_parse("--show-toplevel")
 
+    return git_root.cached_roots[path]
 
+
+@static_vars(cached_files=None)
 def all_files_tracked_by_git():
-    return subprocess.check_output(
-        ["git", "ls-tree", "--full-tree", "-r", "--name-only",
-         "HEAD"]).splitlines()
+    """Set of every file tracked by git at HEAD, with paths relative
+    to the git root. The listing is only requested from git once, and
+    the same set is returned on every subsequent call.
 
+    Returns
+    -------
+    frozenset of str
 
-def all_files_ignored_by_git():
-    return subprocess.check_output(["git", "status", "--ignored"]).splitlines()
+    """
+    if all_files_tracked_by_git.cached_files is None:
+        all_files_tracked_by_git.cached_files = frozenset(
+            subprocess.check_output(
+                ["git", "ls-tree", "--full-tree", "-r", "--name-only",
+                 "HEAD"]).decode().splitlines())
 
+    return all_files_tracked_by_git.cached_files
+
+
+@static_vars(cached_paths=None)
+def all_absolute_paths_tracked_by_git():
+    """Same as all_files_tracked_by_git(), but every path is made
+    absolute by joining it to the git root. Computed once and reused
+    on every subsequent call.
+
+    Returns
+    -------
+    frozenset of str
+
+    """
+    if all_absolute_paths_tracked_by_git.cached_paths is None:
+        git_root_path = git_root(os.getcwd())
+        all_absolute_paths_tracked_by_git.cached_paths = frozenset(
+            os.path.join(git_root_path, f) for f in all_files_tracked_by_git())
+
+    return all_absolute_paths_tracked_by_git.cached_paths
 
-@static_vars(cached_roots={})
-def relative_filepath_is_tracked_by_git(filename):
-    """Checks if the given file, which must exist relative to
-    the path of execution, is being tracked by git.
 
-    TODO: I thought caching the root would help because finding the git
-    root might be slow with so many calls, but I'm not convinced it makes
-    a big difference.
+@static_vars(cached_files={})
+def tracked_files_under(path):
+    """List every file in the git index that lives anywhere below
+    the given path, sorted. Unlike all_files_tracked_by_git(), this
+    includes files that were staged but not committed yet, and leaves
+    out files that were removed with git rm. Git is only asked once
+    for each path.
 
     Parameters
     ----------
-    filename : path to file relative to execution directory
+    path : str, relative to the execution path, e.g. "src/casm"
 
     Returns
     -------
-    bool
+    list of str, relative to the execution path
 
     """
-    cwd = os.getcwd()
+    if path not in tracked_files_under.cached_files:
+        tracked_files_under.cached_files[path] = [
+            f for f in subprocess.check_output(
+                ["git", "ls-files", "-z", "--", path]).decode().split('\0')
+            if f
+        ]
 
-    if cwd not in relative_filepath_is_tracked_by_git.cached_roots or True:
-        relative_filepath_is_tracked_by_git.cached_roots[cwd] = git_root(cwd)
+    return list(tracked_files_under.cached_files[path])
 
-    git_root_path = relative_filepath_is_tracked_by_git.cached_roots[cwd]
 
-    return os.path.relpath(filename,
-                           git_root_path) in all_files_tracked_by_git()
+def all_files_ignored_by_git():
+    return subprocess.check_output(["git", "status", "--ignored"]).splitlines()
 
 
 def purge_untracked_files(file_list):
@@ -344,12 +398,14 @@ def purge_untracked_files(file_list):
     list of path
 
     """
-    return [f for f in file_list if relative_filepath_is_tracked_by_git(f)]
+    tracked_paths = all_absolute_paths_tracked_by_git()
+    return [f for f in file_list if os.path.abspath(f) in tracked_paths]
 
 
-def purge_git_related_files(file_list):
-    """Return the same list of files, but exclude
-    files that exist in the repository for git purposes and
+def purge_untracked_and_git_related_files(file_list):
+    """Return the same list of files, but only include files
+    that are currently being tracked by the git repository, and
+    exclude files that exist in the repository for git purposes and
     are not needed for the build, such as .gitignore.
 
     Parameters
@@ -361,6 +417,9 @@ def purge_git_related_files(file_list):
     list of path
 
     """
-    ignorable = [".gitignore"]
-    return [f for f in file_list if os.path.basename(f) not in ignorable]
+    tracked_paths = all_absolute_paths_tracked_by_git()
+    return [
+        f for f in file_list if os.path.abspath(f) in tracked_paths
+        and os.path.basename(f) not in _GIT_RELATED_FILENAMES
+    ]
 